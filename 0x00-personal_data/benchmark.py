@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the redaction path of filtered_logger
+
+Runs filter_datum and RedactingFormatter over synthetic log corpora and
+reports messages/s, p50/p99 latency and allocated bytes per call.
+Results can be saved as JSON and compared with an earlier run:
+
+    ./benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import random
+import string
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_datum,
+                             row_message)
+
+
+FIELD_NAMES = ("name", "email", "phone", "ssn", "password", "ip",
+               "last_login", "user_agent")
+ROW = ("Marlene Wood", "hwestiii@att.net", "(473) 401-4253", "261-72-6780",
+       "K5?BMNv", "60ed:c396:2ff:244:bbd0:9208:26f2:93ea",
+       "2019-11-14 06:14:24", "Mozilla/5.0 (Windows NT 10.0; WOW64)")
+CORPUS_SIZE = 2000
+ALLOC_SAMPLE = 200
+
+
+def make_corpus(n_fields: int, value_len: int, separator: str,
+                pii_density: float, size: int = CORPUS_SIZE,
+                seed: int = 0) -> Tuple[List[str], List[str]]:
+    """
+    Returns the fields to redact and size messages of n_fields
+    'key=value<separator>' pairs, where about pii_density of the keys are
+    fields to redact
+    """
+    rnd = random.Random(seed)
+    fields = list(PII_FIELDS)
+    others = [f"attr{i}" for i in range(n_fields)]
+    messages = []
+    for _ in range(size):
+        pairs = []
+        for i in range(n_fields):
+            key = rnd.choice(fields) if rnd.random() < pii_density \
+                else others[i]
+            value = ''.join(rnd.choices(string.ascii_letters, k=value_len))
+            pairs.append(f"{key}={value}{separator}")
+        messages.append(''.join(pairs))
+    return fields, messages
+
+
+def make_pathological(length: int, lead: str = "",
+                      size: int = 50) -> List[str]:
+    """ Returns long lines where the field prefixes keep appearing but no
+    separator ever closes them, the worst case of the lazy '.*?' pattern.
+    A separator in lead gets the line past any substring prefilter
+    """
+    chunk = ' '.join(f"{f}=" for f in PII_FIELDS) + ' '
+    line = lead + (chunk * (length // len(chunk) + 1))[:length]
+    return [line] * size
+
+
+def cases() -> List[Tuple[str, Callable[[str], object], List[str]]]:
+    """ Returns (name, function, corpus) for every benchmark """
+    result = []
+    for n_fields in (5, 20):
+        for value_len in (8, 64):
+            for separator in (";", ","):
+                for density in (0.0, 0.5, 1.0):
+                    fields, corpus = make_corpus(n_fields, value_len,
+                                                 separator, density)
+
+                    def run(m, fields=fields, separator=separator):
+                        return filter_datum(fields, "***", m, separator)
+                    result.append((f"filter_datum/fields={n_fields}/"
+                                   f"len={value_len}/sep={separator}/"
+                                   f"pii={density}", run, corpus))
+
+    for length in (1000, 10000):
+        for lead, kind in (("", "no-sep"), (";", "leading-sep")):
+            corpus = make_pathological(length, lead)
+            result.append((f"filter_datum/pathological/{kind}/len={length}",
+                           lambda m: filter_datum(PII_FIELDS, "***", m, ";"),
+                           corpus))
+
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    message = row_message(ROW, FIELD_NAMES)
+    row = dict(zip(FIELD_NAMES, ROW))
+
+    def string_path(m):
+        record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                   m, None, None)
+        return formatter.format(record)
+
+    def structured_path(m):
+        record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                   "", None, None)
+        record.row = m
+        return formatter.format(record)
+
+    result.append(("formatter/string", string_path,
+                   [message] * CORPUS_SIZE))
+    result.append(("formatter/structured", structured_path,
+                   [row] * CORPUS_SIZE))
+    return result
+
+
+def measure(fn: Callable[[str], object], corpus: List[str]) -> Dict:
+    """ Times fn over every message of corpus """
+    for m in corpus[:100]:
+        fn(m)
+    latencies = []
+    clock = time.perf_counter_ns
+    for m in corpus:
+        start = clock()
+        fn(m)
+        latencies.append(clock() - start)
+    latencies.sort()
+    total = sum(latencies)
+
+    tracemalloc.start()
+    allocated = 0
+    sample = corpus[:ALLOC_SAMPLE]
+    for m in sample:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn(m)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        "messages_per_s": len(corpus) / (total / 1e9) if total else 0.0,
+        "p50_us": latencies[len(latencies) // 2] / 1e3,
+        "p99_us": latencies[int(len(latencies) * 0.99)] / 1e3,
+        "alloc_bytes_per_call": allocated / len(sample),
+    }
+
+
+def git_revision() -> str:
+    """ Returns the current commit, or an empty string outside git """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    """ Runs every benchmark and prints, saves or compares the results """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--filter", default="",
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, fn, corpus in cases():
+        if args.filter not in name:
+            continue
+        stats = measure(fn, corpus)
+        results[name] = stats
+        line = (f"{name:<48} {stats['messages_per_s']:>10.0f} msg/s "
+                f"p50 {stats['p50_us']:>8.2f}us "
+                f"p99 {stats['p99_us']:>8.2f}us "
+                f"{stats['alloc_bytes_per_call']:>8.0f} B/call")
+        if name in baseline:
+            ratio = stats['messages_per_s'] / baseline[name]['messages_per_s']
+            line += f" x{ratio:.2f}"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"revision": git_revision(), "results": results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
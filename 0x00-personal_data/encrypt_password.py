@@ -1,11 +1,92 @@
 #!/usr/bin/env python3
 """ Returns a salted, hashed password, byte in string """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count, environ, path, replace
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import json
+import threading
+import time
 import bcrypt
 
 
+HASH_WORKERS = int(environ.get("PERSONAL_DATA_HASH_WORKERS",
+                               str(cpu_count() or 1)))
+DEFAULT_COST = 12
+MIN_COST = 4
+MAX_COST = 31
+COST_FILE = environ.get("PERSONAL_DATA_BCRYPT_COST_FILE",
+                        ".bcrypt_cost.json")
+TARGET_MS = float(environ.get("PERSONAL_DATA_BCRYPT_TARGET_MS", "250"))
+_cost = None
+_cost_lock = threading.Lock()
+
+
+def current_cost() -> int:
+    """ Returns the bcrypt cost factor used for new hashes
+
+    PERSONAL_DATA_BCRYPT_COST wins, then the value saved by
+    calibrate_cost. When PERSONAL_DATA_BCRYPT_TARGET_MS is set and nothing
+    was saved yet, the machine is calibrated on first use
+    """
+    global _cost
+    if _cost is not None:
+        return _cost
+    with _cost_lock:
+        if _cost is not None:
+            return _cost
+        if environ.get("PERSONAL_DATA_BCRYPT_COST"):
+            _cost = int(environ["PERSONAL_DATA_BCRYPT_COST"])
+        elif path.exists(COST_FILE):
+            with open(COST_FILE, 'r') as f:
+                _cost = int(json.load(f)["cost"])
+        elif environ.get("PERSONAL_DATA_BCRYPT_TARGET_MS"):
+            _cost = _calibrate(TARGET_MS)
+        else:
+            _cost = DEFAULT_COST
+    return _cost
+
+
+def _time_hash(cost: int) -> float:
+    """ Returns the milliseconds one hash takes at cost """
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(cost))
+    return (time.perf_counter() - start) * 1000
+
+
+def _calibrate(target_ms: float, persist: bool = True) -> int:
+    """ Finds the highest cost hashing within target_ms and saves it """
+    cost = MIN_COST
+    elapsed = _time_hash(cost)
+    while cost < MAX_COST and elapsed * 2 <= target_ms:
+        cost += 1
+        elapsed = _time_hash(cost)
+    if elapsed > target_ms and cost > MIN_COST:
+        cost -= 1
+        elapsed = _time_hash(cost)
+    if persist:
+        tmp_file = COST_FILE + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({"cost": cost, "target_ms": target_ms,
+                       "hash_ms": round(elapsed, 3)}, f)
+        replace(tmp_file, COST_FILE)
+    return cost
+
+
+def calibrate_cost(target_ms: float = TARGET_MS, persist: bool = True) -> int:
+    """ Benchmarks this machine, and makes the highest cost factor whose
+    hash takes at most target_ms the one used by hash_password
+    """
+    global _cost
+    with _cost_lock:
+        _cost = _calibrate(target_ms, persist)
+    return _cost
+
+
 def hash_password(password: str) -> bytes:
     """ Returns byte string password """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(current_cost()))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -13,3 +94,68 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     matched hashed_password
     """
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """ True if hashed_password wasn't made with the current cost """
+    try:
+        cost = int(hashed_password.split(b'$')[2])
+    except (IndexError, ValueError):
+        return True
+    return cost != current_cost()
+
+
+def verify_and_rehash(hashed_password: bytes,
+                      password: str) -> Tuple[bool, Optional[bytes]]:
+    """ Validates password like is_valid; on success also returns a new
+    hash to store when the current one has an outdated cost
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(password)
+    return True, None
+
+
+def _ordered_map(fn: Callable, items: Iterable,
+                 workers: Optional[int]) -> Iterator:
+    """ Maps fn over items in a thread pool (bcrypt releases the GIL),
+    yielding results in input order with a bounded number in flight
+    """
+    workers = workers or HASH_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, *item))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_hash_many(passwords: Iterable[str],
+                   workers: Optional[int] = None) -> Iterator[bytes]:
+    """ Hashes passwords in parallel, yielding hashes in input order """
+    return _ordered_map(hash_password, ((p,) for p in passwords), workers)
+
+
+def hash_many(passwords: Iterable[str],
+              workers: Optional[int] = None) -> List[bytes]:
+    """ Returns the hashes of passwords, in input order """
+    return list(iter_hash_many(passwords, workers))
+
+
+def iter_verify_many(pairs: Iterable[Tuple[bytes, str]],
+                     workers: Optional[int] = None) -> Iterator[bool]:
+    """ Checks (hashed_password, password) pairs in parallel, yielding
+    results in input order
+    """
+    return _ordered_map(is_valid, pairs, workers)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: Optional[int] = None) -> List[bool]:
+    """ Returns is_valid for every (hashed_password, password) pair, in
+    input order
+    """
+    return list(iter_verify_many(pairs, workers))
@@ -2,40 +2,181 @@
 """
 Module for handling Personal Data
 """
-from typing import List
+from typing import (Any, Iterator, Iterable, List, Mapping, Optional, Pattern,
+                    Sequence, TextIO, Tuple, Union)
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+import argparse
+import atexit
+import copy
+import json
+import os
+import queue
 import re
+import sys
 import logging
+import threading
+import time
+import warnings
 from os import environ
 import mysql.connector
 
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+PATTERN_CACHE_SIZE = 128
+EXPORT_BATCH_SIZE = int(environ.get("PERSONAL_DATA_EXPORT_BATCH_SIZE",
+                                    "1000"))
+EXPORT_BUFFER_SIZE = 1 << 20
+EXPORT_CHECKPOINT = environ.get("PERSONAL_DATA_EXPORT_CHECKPOINT",
+                               ".users_export.checkpoint.json")
+EXPORT_SHARD_SIZE = int(environ.get("PERSONAL_DATA_EXPORT_SHARD_SIZE",
+                                    "50000"))
+LOG_QUEUE_SIZE = int(environ.get("PERSONAL_DATA_LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = environ.get("PERSONAL_DATA_LOG_QUEUE_POLICY", "block")
+_logger_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+_metrics = None
+
+
+def _is_plain(token: str) -> bool:
+    """ True if token has no regex meaning and no '=' in it """
+    return token != "" and "=" not in token and re.escape(token) == token
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _is_inert(redaction: str, fields: Tuple[str, ...],
+              separator: str) -> bool:
+    """ True if the redaction can't create a new match once inserted """
+    if "\\" in redaction or "=" in redaction or separator in redaction:
+        return False
+    return not any(f in redaction for f in fields)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _redaction_pattern(fields: Tuple[str, ...],
+                       separator: str) -> Optional[Pattern]:
+    """ Compiles one pattern matching every field of a (fields, separator)
+    pair, or None when the fields can't be merged safely and the
+    per-field substitution has to be used instead
+    """
+    if not fields or not _is_plain(separator):
+        return None
+    for f in fields:
+        if not _is_plain(f) or separator in f:
+            return None
+    alternation = '|'.join(sorted(set(fields), key=len, reverse=True))
+    return re.compile(f'({alternation})=.*?{separator}')
 
 
 def filter_datum(fields: List[str], redaction: str,
                  message: str, separator: str) -> str:
     """ Returns a log message obfuscated """
-    for f in fields:
-        message = re.sub(f'{f}=.*?{separator}',
-                         f'{f}={redaction}{separator}', message)
+    metrics = _metrics
+    if metrics is None:
+        return _redact(fields, redaction, message, separator)[0]
+    start = time.perf_counter_ns()
+    message, redacted = _redact(fields, redaction, message, separator)
+    metrics.observe(time.perf_counter_ns() - start, redacted)
     return message
 
 
+def _redact(fields: List[str], redaction: str, message: str,
+            separator: str) -> Tuple[str, Optional[int]]:
+    """ filter_datum, also returning the number of values redacted, or
+    None when the prefilter skipped the regex
+    """
+    fields = tuple(fields)
+    pattern = _redaction_pattern(fields, separator)
+    if pattern is None or not _is_inert(redaction, fields, separator):
+        redacted = 0
+        for f in fields:
+            message, n = re.subn(f'{f}=.*?{separator}',
+                                 f'{f}={redaction}{separator}', message)
+            redacted += n
+        return message, redacted
+    if separator not in message or \
+            not any(f'{f}=' in message for f in fields):
+        return message, None
+    return pattern.subn(f'\\g<1>={redaction}{separator}', message)
+
+
+def enable_metrics() -> "RedactionMetrics":
+    """ Turns redaction instrumentation on and returns its metrics """
+    global _metrics
+    if _metrics is None:
+        _metrics = RedactionMetrics()
+    return _metrics
+
+
+def disable_metrics() -> None:
+    """ Turns redaction instrumentation off and drops its metrics """
+    global _metrics
+    _metrics = None
+
+
+def metrics_snapshot() -> Optional[dict]:
+    """ Returns the current redaction metrics, None when disabled """
+    metrics = _metrics
+    return metrics.snapshot() if metrics is not None else None
+
+
+def metrics_prometheus() -> str:
+    """ Returns the redaction metrics in Prometheus text format """
+    metrics = _metrics
+    return metrics.prometheus() if metrics is not None else ""
+
+
 def get_logger() -> logging.Logger:
-    """ Returns a Logger Object """
+    """ Returns a Logger Object
+
+    Records go through a bounded queue to a background listener, which
+    does the redaction and the stream I/O. Calling it again returns the
+    same logger without adding another handler
+    """
     logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
+    with _logger_lock:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        for handler in logger.handlers:
+            if isinstance(handler, BoundedQueueHandler):
+                return logger
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
-    logger.addHandler(stream_handler)
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+        listener = RedactingQueueListener(log_queue, stream_handler)
+        handler = BoundedQueueHandler(log_queue, listener, LOG_QUEUE_POLICY)
+        listener.start()
+        logger.addHandler(handler)
 
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """ Returns a connector to a MySQL database """
+@atexit.register
+def shutdown_logger() -> None:
+    """ Flushes every queued record and stops the background listener,
+    warning about the records dropped on a full queue
+    """
+    logger = logging.getLogger("user_data")
+    with _logger_lock:
+        for handler in list(logger.handlers):
+            if isinstance(handler, BoundedQueueHandler):
+                logger.removeHandler(handler)
+                handler.listener.stop()
+                handler.close()
+                if handler.dropped:
+                    warnings.warn(f"user_data log queue was full: "
+                                  f"{handler.dropped} records dropped",
+                                  RuntimeWarning)
+
+
+def _connect() -> mysql.connector.connection.MySQLConnection:
+    """ Opens a new connection to the MySQL database """
     username = environ.get("PERSONAL_DATA_DB_USERNAME", "root")
     password = environ.get("PERSONAL_DATA_DB_PASSWORD", "")
     host = environ.get("PERSONAL_DATA_DB_HOST", "localhost")
@@ -48,11 +189,417 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return cnx
 
 
-def main():
+def get_db() -> mysql.connector.connection.MySQLConnection:
+    """ Returns a connector to a MySQL database
+
+    When PERSONAL_DATA_DB_POOL_SIZE is set to a positive number, the
+    connection comes from a shared pool and close() hands it back
+    """
+    global _pool
+    pool_size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", "0"))
+    if pool_size <= 0:
+        return _connect()
+    with _pool_lock:
+        if _pool is None:
+            max_age = float(environ.get("PERSONAL_DATA_DB_POOL_MAX_AGE",
+                                        "3600"))
+            _pool = ConnectionPool(_connect, pool_size, max_age)
+    return _pool.acquire()
+
+
+@contextmanager
+def db_connection() -> Iterator[mysql.connector.connection.MySQLConnection]:
+    """ Context manager around get_db that always releases the
+    connection, back to the pool when pooling is on
+    """
+    cnx = get_db()
+    try:
+        yield cnx
+    finally:
+        cnx.close()
+
+
+def row_message(row: Sequence, field_names: Sequence[str]) -> str:
+    """ Returns a users row as a 'field=value;' log message """
+    str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
+    return str_row.strip()
+
+
+def export_users(stream: Optional[TextIO] = None,
+                 batch_size: int = EXPORT_BATCH_SIZE,
+                 pushdown: bool = False) -> int:
+    """
+    Streams the users table through an unbuffered cursor in batches of
+    batch_size rows, and writes each batch as filtered log lines with a
+    single write. With pushdown, PII columns are masked by the server.
+    Returns the number of rows exported
+    """
+    projection = _users_projection() if pushdown else "*"
+    count, _ = _export_query(f"SELECT {projection} FROM users;", (), stream,
+                             batch_size)
+    return count
+
+
+def _users_projection() -> str:
+    """
+    Returns the select list of the users table in which every PII column
+    is replaced by the redaction literal, so the database never sends
+    the clear values
+    """
+    with db_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS"
+                       " WHERE TABLE_SCHEMA = DATABASE()"
+                       " AND TABLE_NAME = 'users' ORDER BY ORDINAL_POSITION;")
+        columns = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    redaction = RedactingFormatter.REDACTION.replace("'", "''")
+    projection = []
+    for column in columns:
+        quoted = '`{}`'.format(column.replace('`', '``'))
+        if column in PII_FIELDS:
+            projection.append(f"'{redaction}' AS {quoted}")
+        else:
+            projection.append(quoted)
+    return ', '.join(projection)
+
+
+def _export_query(query: str, params: tuple, stream: Optional[TextIO],
+                  batch_size: int,
+                  watermark: Optional[str] = None) -> Tuple[int, Any]:
+    """
+    Runs query and streams its rows as in export_users. Returns the row
+    count and the value of the watermark column in the last row
+    """
+    if stream is None:
+        out = open(sys.stderr.fileno(), 'w', buffering=EXPORT_BUFFER_SIZE,
+                   closefd=False)
+    else:
+        out = stream
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    count = 0
+    last = None
+    try:
+        cursor.execute(query, params)
+        field_names = [i[0] for i in cursor.description]
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            out.write(formatter.format_batch(
+                "user_data", (dict(zip(field_names, r)) for r in rows)))
+            count += len(rows)
+            if watermark is not None:
+                last = rows[-1][field_names.index(watermark)]
+            rows = cursor.fetchmany(batch_size)
+    finally:
+        out.flush()
+        if stream is None:
+            out.close()
+        cursor.close()
+        db.close()
+    return count, last
+
+
+def _read_checkpoint(checkpoint: str) -> Optional[dict]:
+    """ Returns the saved high-water mark, None if there is none """
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint, 'r') as f:
+        return json.load(f)
+
+
+def _write_checkpoint(checkpoint: str, column: str, value: Any) -> None:
+    """ Atomically replaces the checkpoint file """
+    if not isinstance(value, (int, float)):
+        value = str(value)
+    tmp_file = checkpoint + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"column": column, "value": value}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint)
+
+
+def export_users_incremental(column: Optional[str] = None,
+                             checkpoint: str = EXPORT_CHECKPOINT,
+                             full: bool = False,
+                             stream: Optional[TextIO] = None,
+                             batch_size: int = EXPORT_BATCH_SIZE,
+                             pushdown: bool = False) -> int:
+    """
+    Exports only the users rows past the high-water mark saved in
+    checkpoint by the previous run, ordered by column (the primary key
+    by default), then moves the mark to the last exported row.
+    full ignores the saved mark, and drops it when users is empty,
+    pushdown works as in export_users.
+    Returns the number of rows exported
+    """
+    if column is None:
+        with db_connection() as db:
+            column = _primary_key(db)
+        if column is None:
+            raise ValueError("users has no single-column primary key, "
+                             "a watermark column is required")
+    if not re.fullmatch(r'\w+', column):
+        raise ValueError(f"Invalid watermark column: {column}")
+    if pushdown and column in PII_FIELDS:
+        raise ValueError(f"Watermark column {column} is masked by pushdown")
+
+    projection = _users_projection() if pushdown else "*"
+    mark = None if full else _read_checkpoint(checkpoint)
+    qualified = _column(column)
+    if mark is not None and mark.get("column") == column:
+        query = f"SELECT {projection} FROM users WHERE {qualified} > %s " \
+                f"ORDER BY {qualified};"
+        params = (mark["value"],)
+    else:
+        query = f"SELECT {projection} FROM users ORDER BY {qualified};"
+        params = ()
+
+    count, last = _export_query(query, params, stream, batch_size, column)
+    if count:
+        _write_checkpoint(checkpoint, column, last)
+    elif full and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return count
+
+
+def _column(column: str) -> str:
+    """ Quotes a column of users with its table name, so that ORDER BY and
+    WHERE see the stored value even when the select list masks it under
+    the same alias
+    """
+    return '`users`.`{}`'.format(column.replace('`', '``'))
+
+
+def _primary_key(db: mysql.connector.connection.MySQLConnection
+                 ) -> Optional[str]:
+    """ Returns the single-column primary key of users, if there is one """
+    cursor = db.cursor()
+    cursor.execute("SELECT COLUMN_NAME"
+                   " FROM information_schema.KEY_COLUMN_USAGE"
+                   " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'"
+                   " AND CONSTRAINT_NAME = 'PRIMARY';")
+    keys = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return keys[0] if len(keys) == 1 else None
+
+
+def _order_columns(db: mysql.connector.connection.MySQLConnection
+                   ) -> List[str]:
+    """ Returns the columns giving users a total order: its primary key,
+    or every column when it has none (identical rows are interchangeable)
+    """
+    key = _primary_key(db)
+    if key is not None:
+        return [key]
+    cursor = db.cursor()
+    cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS"
+                   " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'"
+                   " ORDER BY ORDINAL_POSITION;")
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+
+def _forget_pool() -> None:
+    """ Worker initializer: connections pooled by the parent process must
+    not be shared with its forked children
+    """
+    global _pool
+    _pool = None
+
+
+def _shard_ranges(db: mysql.connector.connection.MySQLConnection,
+                  key: str, shard_size: int) -> List[Tuple[Any, Any]]:
+    """
+    Returns the (lower, upper] primary key ranges holding shard_size rows
+    each, read in a single scan of the key. The first range has no lower
+    bound and the last one no upper bound, so rows inserted meanwhile
+    still fall in one of them
+    """
+    ranges = []
+    lower = None
+    seen = 0
+    cursor = db.cursor(buffered=False)
+    cursor.execute(f"SELECT {_column(key)} FROM users "
+                   f"ORDER BY {_column(key)};")
+    rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+    while rows:
+        for row in rows:
+            seen += 1
+            if seen % shard_size == 0:
+                ranges.append((lower, row[0]))
+                lower = row[0]
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+    cursor.close()
+    ranges.append((lower, None))
+    return ranges
+
+
+def _range_shard(key: str, lower: Any, upper: Any) -> Tuple[str, tuple]:
+    """ Returns the clause and parameters selecting a key range shard """
+    conditions = []
+    params = []
+    if lower is not None:
+        conditions.append(f"{_column(key)} > %s")
+        params.append(lower)
+    if upper is not None:
+        conditions.append(f"{_column(key)} <= %s")
+        params.append(upper)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    return f"{where}ORDER BY {_column(key)}", tuple(params)
+
+
+def _offset_shard(order_by: Sequence[str], offset: int,
+                  limit: int) -> Tuple[str, tuple]:
+    """ Returns the clause and parameters selecting the rows in
+    [offset, offset + limit) of the order_by order
+    """
+    order = ", ".join(_column(column) for column in order_by)
+    return f"ORDER BY {order} LIMIT %s OFFSET %s", (limit, offset)
+
+
+def _export_shard(clause: str, params: tuple, batch_size: int,
+                  out_path: Optional[str],
+                  projection: str = "*") -> Tuple[int, str]:
+    """
+    Worker: redacts the users rows selected by clause on its own
+    connection. Returns the row count and, when out_path is None, the
+    formatted lines; otherwise the lines are written to out_path
+    """
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    query = f"SELECT {projection} FROM users {clause};"
+    chunks = []
+    count = 0
+    with db_connection() as db:
+        cursor = db.cursor(buffered=False)
+        cursor.execute(query, params)
+        field_names = [i[0] for i in cursor.description]
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            chunks.append(formatter.format_batch(
+                "user_data", (dict(zip(field_names, r)) for r in rows)))
+            count += len(rows)
+            rows = cursor.fetchmany(batch_size)
+        cursor.close()
+    text = ''.join(chunks)
+    if out_path is None:
+        return count, text
+    with open(out_path, 'w', buffering=EXPORT_BUFFER_SIZE) as f:
+        f.write(text)
+    return count, ""
+
+
+def export_users_parallel(workers: int = os.cpu_count() or 1,
+                          shard_size: int = EXPORT_SHARD_SIZE,
+                          output_dir: Optional[str] = None,
+                          stream: Optional[TextIO] = None,
+                          batch_size: int = EXPORT_BATCH_SIZE,
+                          pushdown: bool = False) -> Tuple[int, float]:
+    """
+    Splits the users table in shards of shard_size rows and redacts them
+    in a pool of worker processes. Shards are primary key ranges, so each
+    one is read straight from the index; without a single-column primary
+    key they are LIMIT/OFFSET slices ordered by every column, so that
+    separate queries agree on the order. Shards are written in order to
+    stream (stderr by default), or to users.<n>.log files in output_dir.
+    pushdown works as in export_users.
+    Returns the number of rows exported and the throughput in rows/s
+    """
+    start = time.perf_counter()
+    with db_connection() as db:
+        key = _primary_key(db)
+        if key is not None:
+            shards = [_range_shard(key, lower, upper) for lower, upper
+                      in _shard_ranges(db, key, shard_size)]
+        else:
+            order_by = _order_columns(db)
+            cursor = db.cursor()
+            cursor.execute("SELECT COUNT(*) FROM users;")
+            total = cursor.fetchone()[0]
+            cursor.close()
+            shards = [_offset_shard(order_by, offset, shard_size)
+                      for offset in range(0, total, shard_size)]
+    projection = _users_projection() if pushdown else "*"
+
+    out = stream if stream is not None else sys.stderr
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_forget_pool) as executor:
+        pending = deque()
+        for n, (clause, params) in enumerate(shards):
+            out_path = None
+            if output_dir is not None:
+                out_path = os.path.join(output_dir, f"users.{n}.log")
+            pending.append(executor.submit(_export_shard, clause, params,
+                                           batch_size, out_path, projection))
+            while len(pending) > 2 * workers:
+                count += _write_shard(pending.popleft().result(), out)
+        while pending:
+            count += _write_shard(pending.popleft().result(), out)
+    out.flush()
+
+    elapsed = time.perf_counter() - start
+    return count, count / elapsed if elapsed > 0 else 0.0
+
+
+def _write_shard(result: Tuple[int, str], out: TextIO) -> int:
+    """ Writes the lines returned by a worker, returns its row count """
+    count, text = result
+    if text:
+        out.write(text)
+    return count
+
+
+def main(argv: Optional[List[str]] = None):
     """
     Obtain a database connection using get_db and retrieves all rows
     in the users table and display each row under a filtered format
     """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream rows in batches instead of logging "
+                        "them one by one")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE,
+                        help="rows fetched per batch in --stream mode")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="export shards in this many processes")
+    parser.add_argument("--shard-size", type=int, default=EXPORT_SHARD_SIZE,
+                        help="rows per shard in --workers mode")
+    parser.add_argument("--output-dir",
+                        help="write one file per shard in --workers mode")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only export rows past the last checkpoint")
+    parser.add_argument("--full", action="store_true",
+                        help="with --incremental, export every row and "
+                        "reset the checkpoint")
+    parser.add_argument("--watermark-column",
+                        help="column ordering --incremental exports "
+                        "(the primary key by default)")
+    parser.add_argument("--checkpoint", default=EXPORT_CHECKPOINT,
+                        help="checkpoint file of --incremental mode")
+    parser.add_argument("--pushdown", action="store_true",
+                        help="mask PII columns in the SQL query itself "
+                        "(with --stream, --workers or --incremental)")
+    args = parser.parse_args(argv)
+    if args.incremental:
+        export_users_incremental(args.watermark_column, args.checkpoint,
+                                 args.full, batch_size=args.batch_size,
+                                 pushdown=args.pushdown)
+        return
+    if args.workers > 0:
+        count, rate = export_users_parallel(args.workers, args.shard_size,
+                                            args.output_dir,
+                                            batch_size=args.batch_size,
+                                            pushdown=args.pushdown)
+        print(f"{count} rows exported ({rate:.0f} rows/s)")
+        return
+    if args.stream:
+        export_users(batch_size=args.batch_size, pushdown=args.pushdown)
+        return
+
     db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
@@ -61,8 +608,7 @@ def main():
     logger = get_logger()
 
     for row in cursor:
-        str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
-        logger.info(str_row.strip())
+        logger.info(row_message(row, field_names))
 
     cursor.close()
     db.close()
@@ -78,14 +624,317 @@ class RedactingFormatter(logging.Formatter):
 
     def __init__(self, fields: List[str]):
         super(RedactingFormatter, self).__init__(self.FORMAT)
-        self.fields = fields
+        self.fields = tuple(fields)
+        self._field_set = frozenset(fields)
 
     def format(self, record: logging.LogRecord) -> str:
-        """ Filters values in incoming log records using filter_datum """
-        record.msg = filter_datum(self.fields, self.REDACTION,
-                                  record.getMessage(), self.SEPARATOR)
+        """ Filters values in incoming log records using filter_datum
+
+        A record carrying a mapping, either as extra={"row": ...} or as
+        its only argument, is masked by key instead and rendered once
+        """
+        row = _record_row(record)
+        metrics = _metrics
+        if metrics is not None:
+            metrics.count_record(row, self._field_set)
+        if row is not None:
+            message = self.redact_row(row)
+            if record.msg:
+                message = f'{record.msg} {message}'
+            record.msg = message
+            record.args = None
+        else:
+            record.msg = filter_datum(self.fields, self.REDACTION,
+                                      record.getMessage(), self.SEPARATOR)
         return super(RedactingFormatter, self).format(record)
 
+    def redact_row(self, row: Mapping) -> str:
+        """ Renders a mapping as 'key=value;' pairs, masking PII keys """
+        if not row:
+            return ""
+        redaction, fields = self.REDACTION, self._field_set
+        return '; '.join(f'{k}={redaction if k in fields else v}'
+                         for k, v in row.items()) + self.SEPARATOR
+
+    def format_batch(self, name: str,
+                     messages: Iterable[Union[str, Mapping]]) -> str:
+        """ Filters and formats many INFO messages, strings or mappings,
+        at once; the batch shares one timestamp so the line prefix is only
+        rendered once
+        """
+        record = logging.LogRecord(name, logging.INFO, __file__, 0,
+                                   "", None, None)
+        prefix = super(RedactingFormatter, self).format(record)
+        lines = []
+        metrics = _metrics
+        for m in messages:
+            if metrics is not None:
+                metrics.count_record(m if isinstance(m, Mapping) else None,
+                                     self._field_set)
+            if isinstance(m, Mapping):
+                lines.append(prefix + self.redact_row(m))
+            else:
+                lines.append(prefix + filter_datum(self.fields,
+                                                   self.REDACTION, m,
+                                                   self.SEPARATOR))
+        if not lines:
+            return ""
+        return '\n'.join(lines) + '\n'
+
+
+def _record_row(record: logging.LogRecord) -> Optional[Mapping]:
+    """ Returns the mapping carried by a structured record, if any """
+    row = getattr(record, "row", None)
+    if isinstance(row, Mapping):
+        return row
+    if isinstance(record.args, Mapping) and record.args and \
+            '%' not in str(record.msg):
+        return record.args
+    return None
+
+
+class RedactionMetrics:
+    """ Counters and filter_datum latency histogram of the redaction path
+    """
+
+    BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+               1e-3, 1e-2)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = 0
+        self.structured_records = 0
+        self.fields_redacted = 0
+        self.messages_skipped = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, elapsed_ns: int, redacted: Optional[int]) -> None:
+        """ Records one filter_datum call """
+        elapsed = elapsed_ns / 1e9
+        i = bisect_left(self.BUCKETS, elapsed)
+        with self._lock:
+            self.calls += 1
+            self.seconds += elapsed
+            self.bucket_counts[i] += 1
+            if redacted is None:
+                self.messages_skipped += 1
+            else:
+                self.fields_redacted += redacted
+
+    def count_record(self, row: Optional[Mapping], fields: frozenset) -> None:
+        """ Records one formatted record, masked by key if row is given """
+        with self._lock:
+            self.records += 1
+            if row is not None:
+                self.structured_records += 1
+                self.fields_redacted += sum(1 for k in row if k in fields)
+
+    def snapshot(self) -> dict:
+        """ Returns a consistent copy of every metric """
+        with self._lock:
+            return {
+                "records": self.records,
+                "structured_records": self.structured_records,
+                "fields_redacted": self.fields_redacted,
+                "messages_skipped": self.messages_skipped,
+                "filter_datum_calls": self.calls,
+                "filter_datum_seconds": self.seconds,
+                "filter_datum_buckets": dict(zip(
+                    [str(b) for b in self.BUCKETS] + ["+Inf"],
+                    self.bucket_counts)),
+            }
+
+    def prometheus(self) -> str:
+        """ Returns the metrics in Prometheus text exposition format """
+        snap = self.snapshot()
+        lines = []
+        for name, key, help_text in (
+                ("redaction_records_total", "records",
+                 "Log records formatted"),
+                ("redaction_structured_records_total", "structured_records",
+                 "Log records masked by key"),
+                ("redaction_fields_redacted_total", "fields_redacted",
+                 "Field values redacted"),
+                ("redaction_messages_skipped_total", "messages_skipped",
+                 "Messages that skipped the regex")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {snap[key]}")
+        name = "redaction_filter_datum_seconds"
+        lines.append(f"# HELP {name} filter_datum latency")
+        lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for le, count in snap["filter_datum_buckets"].items():
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {snap['filter_datum_seconds']}")
+        lines.append(f"{name}_count {snap['filter_datum_calls']}")
+        return '\n'.join(lines) + '\n'
+
+
+class ConnectionPool:
+    """ Pool of MySQL connections
+
+    Up to size idle connections are kept. A connection is pinged before
+    it is handed out and is dropped once it is older than max_age seconds
+    """
+
+    def __init__(self, factory, size: int, max_age: float = 3600):
+        self._factory = factory
+        self._idle = queue.LifoQueue(size)
+        self.size = size
+        self.max_age = max_age
+
+    def acquire(self) -> "PooledConnection":
+        """ Checks out a live connection, opening one if none is idle """
+        while True:
+            try:
+                created_at, cnx = self._idle.get_nowait()
+            except queue.Empty:
+                return PooledConnection(self, self._factory(),
+                                        time.monotonic())
+            if time.monotonic() - created_at > self.max_age:
+                self._discard(cnx)
+                continue
+            try:
+                cnx.ping(reconnect=False)
+            except mysql.connector.Error:
+                self._discard(cnx)
+                continue
+            return PooledConnection(self, cnx, created_at)
+
+    def release(self, cnx: mysql.connector.connection.MySQLConnection,
+                created_at: float) -> None:
+        """ Returns a connection to the pool, or closes it when it is
+        stale, has pending results or the pool is full
+        """
+        if time.monotonic() - created_at > self.max_age:
+            self._discard(cnx)
+            return
+        try:
+            cnx.rollback()
+        except mysql.connector.Error:
+            self._discard(cnx)
+            return
+        try:
+            self._idle.put_nowait((created_at, cnx))
+        except queue.Full:
+            self._discard(cnx)
+
+    def close(self) -> None:
+        """ Closes every idle connection """
+        while True:
+            try:
+                _, cnx = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(cnx)
+
+    @staticmethod
+    def _discard(cnx: mysql.connector.connection.MySQLConnection) -> None:
+        """ Closes a connection, ignoring errors from dead sockets """
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+
+
+class PooledConnection:
+    """ Checked out connection: behaves like the MySQLConnection it wraps,
+    except that close() gives it back to its pool
+    """
+
+    def __init__(self, pool: ConnectionPool,
+                 cnx: mysql.connector.connection.MySQLConnection,
+                 created_at: float):
+        self._pool = pool
+        self._cnx = cnx
+        self._created_at = created_at
+
+    def __getattr__(self, name: str):
+        if self._cnx is None:
+            raise mysql.connector.InterfaceError(
+                "Connection was returned to the pool")
+        return getattr(self._cnx, name)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Returns the connection to the pool """
+        if self._cnx is not None:
+            cnx, self._cnx = self._cnx, None
+            self._pool.release(cnx, self._created_at)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """ Queue handler applying an overflow policy when the queue is full:
+    'block' waits (the default, so no record is lost), 'drop_oldest'
+    discards the oldest pending record and counts it in dropped
+    """
+
+    POLICIES = ("drop_oldest", "block")
+
+    def __init__(self, log_queue: queue.Queue, listener: QueueListener,
+                 policy: str = "block"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.listener = listener
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Leaves structured records unrendered for the listener """
+        if _record_row(record) is not None:
+            return copy.copy(record)
+        return super(BoundedQueueHandler, self).prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Puts record on the queue following the overflow policy """
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class RedactingQueueListener(QueueListener):
+    """ Queue listener whose stop sentinel can't be lost on a full queue
+    """
+
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler):
+        super(RedactingQueueListener, self).__init__(
+            log_queue, *handlers, respect_handler_level=True)
+
+    def enqueue_sentinel(self) -> None:
+        """ Waits for room in the queue before posting the sentinel """
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        """ Drains the queue, then flushes the handlers """
+        super(RedactingQueueListener, self).stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+if environ.get("PERSONAL_DATA_REDACTION_METRICS"):
+    enable_metrics()
+
 
 if __name__ == '__main__':
     main()
@@ -2,10 +2,11 @@
 """ DocDocDocDocDocDoc
 """
 from flask import Blueprint
+from models.base import LAZY_LOAD
 
 app_views = Blueprint("app_views", __name__, url_prefix="/api/v1")
 
 from api.v1.views.index import *
 from api.v1.views.users import *
 
-User.load_from_file()
+User.load_from_file(lazy=LAZY_LOAD)
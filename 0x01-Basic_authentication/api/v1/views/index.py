@@ -26,6 +26,24 @@ def stats() -> str:
     return jsonify(stats)
 
 
+@app_views.route('/stats/storage', strict_slashes=False)
+def stats_storage() -> str:
+    """ GET /api/v1/stats/storage
+    Return:
+      - the storage engine, and for each class: the number of objects,
+        data file size, index sizes, and load, save_to_file and write
+        timings (count, last, average and p99 in milliseconds)
+    """
+    from models.storage import SHARED, get_storage
+    from models.user import User
+    stats = {
+        "engine": type(get_storage()).__name__,
+        "shared": SHARED,
+        "classes": {"User": User.storage_stats()},
+    }
+    return jsonify(stats)
+
+
 @app_views.route('/unauthorized', methods=['GET'], strict_slashes=False)
 def unauthorized() -> None:
     """ GET /app/vi/unauthorized
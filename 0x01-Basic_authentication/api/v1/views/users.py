@@ -2,18 +2,203 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from datetime import datetime
+from flask import Response, abort, jsonify, request, stream_with_context
+from models.base import TIMESTAMP_FORMAT, parse_timestamp
 from models.user import User
+from urllib.parse import urlencode
+
+
+STREAM_CHUNK_SIZE = 500
+CURSOR_TIME_FORMAT = TIMESTAMP_FORMAT + ".%f"
+
+
+def not_modified(etag: str) -> Response:
+    """ 304 response if the client already holds the representation
+    tagged etag, else None
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def json_response(data: str, etag: str) -> Response:
+    """ Response of already serialized JSON, tagged etag
+    """
+    response = Response(data + "\n", mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: maximum number of users to return
+      - after: cursor given by the Link header of the previous page: the
+        ID of its last user, or with the filters below, that user's
+        sort value and ID as <value>|<ID>
+      - email_prefix: only users whose email starts with it, ordered
+        by email
+      - created_after, created_before: only users created strictly
+        after or before this TIMESTAMP_FORMAT time, ordered by creation
+        time unless email_prefix is given too
+      - stream: "json" (or "1") streams the JSON list, "ndjson" one
+        user per line; also picked by an Accept: application/x-ndjson.
+        Not available with the filters above
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, ordered by ID when
+        paginated, with a Link header to the next page
+      - 304 if If-None-Match holds the ETag of the current users
+      - 400 if limit isn't a positive integer, or a time or the after
+        cursor is malformed
+    """
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return jsonify({'error': "limit must be a positive integer"}), 400
+
+    bounds = {}
+    for name in ("created_after", "created_before"):
+        if request.args.get(name) is not None:
+            try:
+                bounds[name] = parse_timestamp(request.args.get(name))
+            except ValueError:
+                return jsonify({'error': "{} must be formatted as {}".format(
+                    name, TIMESTAMP_FORMAT)}), 400
+    email_prefix = request.args.get("email_prefix")
+    if email_prefix is not None or bounds:
+        etag = User.version()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        try:
+            users = filter_users(email_prefix, bounds.get("created_after"),
+                                 bounds.get("created_before"), limit, after)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = json_response(
+            "[" + ",".join(user.cached_json()[0] for user in users) + "]",
+            etag)
+        if limit is not None and len(users) == limit:
+            query = request.args.to_dict()
+            query["after"] = filter_cursor(email_prefix, users[-1])
+            response.headers["Link"] = '<{}?{}>; rel="next"'.format(
+                request.base_url, urlencode(query))
+        return response
+
+    stream = request.args.get("stream")
+    if stream is None and \
+            request.accept_mimetypes.best == "application/x-ndjson":
+        stream = "ndjson"
+    ndjson = stream == "ndjson"
+    etag = User.version() + ("-ndjson" if ndjson else "")
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if stream is not None:
+        response = Response(stream_with_context(stream_users(limit, after,
+                                                             ndjson)),
+                            mimetype="application/x-ndjson" if ndjson
+                            else "application/json")
+        response.set_etag(etag)
+        return response
+
+    if limit is None and after is None:
+        users = User.all()
+    else:
+        users = User.page(limit, after)
+    response = json_response(
+        "[" + ",".join(user.cached_json()[0] for user in users) + "]", etag)
+    if limit is not None and len(users) == limit:
+        response.headers["Link"] = '<{}?{}>; rel="next"'.format(
+            request.base_url, urlencode({"limit": limit,
+                                         "after": users[-1].id}))
+    return response
+
+
+def filter_cursor(email_prefix: str, user: User) -> str:
+    """ The after cursor of the filtered page ending with user: its sort
+    value and its ID, so it doesn't depend on user still existing
+    """
+    if email_prefix is None:
+        value = user.created_at.strftime(CURSOR_TIME_FORMAT)
+    else:
+        value = user.email
+    return "{}|{}".format(value, user.id)
+
+
+def parse_filter_cursor(email_prefix: str, after: str) -> tuple:
+    """ The (sort value, ID) of an after cursor made by filter_cursor
+    """
+    value, separator, user_id = after.rpartition("|")
+    if not separator:
+        raise ValueError("Malformed cursor: {}".format(after))
+    if email_prefix is None:
+        try:
+            value = datetime.strptime(value, CURSOR_TIME_FORMAT)
+        except ValueError:
+            raise ValueError("Malformed cursor: {}".format(after))
+    return value, user_id
+
+
+def filter_users(email_prefix: str = None, created_after=None,
+                 created_before=None, limit: int = None,
+                 after: str = None) -> list:
+    """ Users matching the filters of view_all_users, through the sorted
+    index of email when email_prefix is given, else of created_at
+    """
+    if after is not None:
+        after = parse_filter_cursor(email_prefix, after)
+    if email_prefix is None:
+        return User.search_range("created_at", created_after,
+                                 created_before, limit=limit, cursor=after)
+    if created_after is None and created_before is None:
+        return User.search_range("email", prefix=email_prefix, limit=limit,
+                                 cursor=after)
+    users = [user for user in User.search_range("email",
+                                                prefix=email_prefix,
+                                                cursor=after)
+             if (created_after is None or user.created_at > created_after)
+             and (created_before is None
+                  or user.created_at < created_before)]
+    return users if limit is None else users[:limit]
+
+
+def stream_users(limit: int = None, after: str = None,
+                 ndjson: bool = False):
+    """ Generate the JSON list, or the NDJSON lines, of the users
+    ordered by ID, fetching STREAM_CHUNK_SIZE users at a time
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if not ndjson:
+        yield "["
+    separator = ""
+    while limit is None or limit > 0:
+        size = STREAM_CHUNK_SIZE if limit is None \
+            else min(limit, STREAM_CHUNK_SIZE)
+        users = User.page(size, after)
+        if not users:
+            break
+        items = [user.cached_json()[0] for user in users]
+        if ndjson:
+            yield "\n".join(items) + "\n"
+        else:
+            yield separator + ",".join(items)
+            separator = ","
+        if limit is not None:
+            limit -= len(users)
+        if len(users) < size:
+            break
+        after = users[-1].id
+    if not ndjson:
+        yield "]\n"
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -23,6 +208,7 @@ def view_one_user(user_id: str = None) -> str:
       - User ID
     Return:
       - User object JSON represented
+      - 304 if If-None-Match holds the ETag of the user
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -30,7 +216,11 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    data, etag = user.cached_json()
+    response = not_modified(etag)
+    if response is None:
+        response = json_response(data, etag)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -89,6 +279,92 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+def bulk_status(results: list, success: int, failure: int) -> int:
+    """ success when every item succeeded, failure when none did, else
+    207
+    """
+    failed = sum(1 for result in results if result["status"] != success)
+    if failed == 0:
+        return success
+    return failure if failed == len(results) else 207
+
+
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    JSON body:
+      - list of users, each with the fields of POST /api/v1/users
+    Return:
+      - {"results": [...]} with, in the order of the body, either
+        {"status": 201, "user": User JSON represented} or
+        {"status": 400, "error": message}; every valid user is created
+        and saved with a single write
+      - status 201 if every user was created, 207 if only some, 400 if
+        none or the body isn't a list
+    """
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if not isinstance(rj, list):
+        return jsonify({'error': "Wrong format"}), 400
+    results = []
+    users = []
+    for item in rj:
+        error_msg = None
+        if not isinstance(item, dict):
+            error_msg = "Wrong format"
+        elif item.get("email", "") == "":
+            error_msg = "email missing"
+        elif item.get("password", "") == "":
+            error_msg = "password missing"
+        else:
+            try:
+                user = User()
+                user.email = item.get("email")
+                user.password = item.get("password")
+                user.first_name = item.get("first_name")
+                user.last_name = item.get("last_name")
+                users.append(user)
+                results.append({"status": 201, "user": user})
+                continue
+            except Exception as e:
+                error_msg = "Can't create User: {}".format(e)
+        results.append({"status": 400, "error": error_msg})
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    for result in results:
+        if "user" in result:
+            result["user"] = result["user"].to_json()
+    return jsonify({"results": results}), bulk_status(results, 201, 400)
+
+
+@app_views.route('/users/bulk', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/bulk
+    JSON body:
+      - list of User IDs
+    Return:
+      - {"results": [...]} with {"id": User ID, "status": 200} for every
+        deleted user, or 404 if the ID doesn't exist; all deletions are
+        saved with a single write
+      - status 200 if every user was deleted, 207 if only some, 404 if
+        none, 400 if the body isn't a list
+    """
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if not isinstance(rj, list):
+        return jsonify({'error': "Wrong format"}), 400
+    removed = set(User.remove_many(i for i in rj if isinstance(i, str)))
+    results = [{"id": i, "status": 200 if isinstance(i, str) and i in removed
+                else 404} for i in rj]
+    return jsonify({"results": results}), bulk_status(results, 200, 404)
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
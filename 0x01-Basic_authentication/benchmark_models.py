@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+""" Benchmarks of the models storage layer
+
+Usage:
+  ./benchmark_models.py memory [number_of_users]
+  ./benchmark_models.py storage [number_of_users] [engine ...]
+"""
+from datetime import datetime
+import gc
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from models import base, storage
+from models.user import User
+
+
+class DictUser():
+    """ Stand-alone copy of the User layout before __slots__: the same
+    attributes, set the same way, but kept in a per-object __dict__.
+    It can't subclass User, whose slots would still hold them
+    """
+
+    def __init__(self, *args: list, **kwargs: dict):
+        """ Initialize the attributes as Base and User did
+        """
+        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+    @property
+    def password(self) -> str:
+        """ Getter of the password
+        """
+        return self._password
+
+    @password.setter
+    def password(self, pwd: str):
+        """ Setter of a new password: encrypt in SHA256
+        """
+        self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+
+
+def make_user(cls: type, i: int) -> User:
+    """ Build a user with realistic field sizes
+    """
+    user = cls(email="user{}@example.com".format(i),
+               first_name="First{}".format(i),
+               last_name="Last{}".format(i))
+    user.password = "pwd{}".format(i)
+    return user
+
+
+def bytes_per_user(cls: type, n: int) -> float:
+    """ Average memory held by one stored user, timestamps and strings
+    included
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = {}
+    for i in range(n):
+        user = make_user(cls, i)
+        users[user.id] = user
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n
+
+
+def bench_memory(n: int):
+    """ Prints the memory per user of both representations
+    """
+    for cls in (User, DictUser):
+        print("{:<9} {:>8.1f} bytes/user at {} users".format(
+            cls.__name__, bytes_per_user(cls, n), n))
+
+
+def bench_engine(name: str, n: int, saves: int = 20) -> dict:
+    """ Times a full save_to_file, a full load_from_file and single
+    object saves and removes with one storage engine, in a scratch
+    directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            storage.use_storage(name)
+            base.DATA["User"] = {}
+            for i in range(n):
+                user = make_user(User, i)
+                base.DATA["User"][user.id] = user
+            User._rebuild_indexes()
+
+            start = time.perf_counter()
+            User.save_to_file()
+            dump_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            User.load_from_file()
+            load_s = time.perf_counter() - start
+            if User.count() != n:
+                raise AssertionError("{} lost objects: {} of {}".format(
+                    name, User.count(), n))
+
+            users = User.all()[:saves]
+            start = time.perf_counter()
+            for user in users:
+                user.first_name = "Changed"
+                user.save()
+            for user in users:
+                user.remove()
+            write_ms = (time.perf_counter() - start) * 1000 / (2 * saves)
+
+            User.load_from_file()
+            if User.count() != n - len(users):
+                raise AssertionError("{} didn't persist single writes"
+                                     .format(name))
+            size = sum(os.path.getsize(f) for f in os.listdir("."))
+        finally:
+            os.chdir(cwd)
+    return {"dump_s": dump_s, "load_s": load_s, "write_ms": write_ms,
+            "bytes": size}
+
+
+def bench_storage(n: int, engines: list):
+    """ Prints the load and save costs of every storage engine
+    """
+    for name in engines:
+        r = bench_engine(name, n)
+        print("{:<8} save_to_file {:>7.3f}s  load_from_file {:>7.3f}s  "
+              "save/remove {:>8.3f}ms  {:>11} bytes on disk".format(
+                  name, r["dump_s"], r["load_s"], r["write_ms"],
+                  r["bytes"]))
+
+
+def main():
+    """ Runs the benchmark named on the command line
+    """
+    what = sys.argv[1] if len(sys.argv) > 1 else "memory"
+    if what == "memory":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+        bench_memory(n)
+    elif what == "storage":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        bench_storage(n, sys.argv[3:] or list(storage.ENGINES))
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,100 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from functools import lru_cache
+from typing import TypeVar, List, Iterable, Tuple
+from os import getenv
+from models.locking import ReadWriteLock
+from models.stats import Timings
+from models.storage import POLL_MS, SHARED, get_storage
+import os
+import hashlib
 import json
+import re
+import sys
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+_TIMESTAMP_LAYOUT = re.compile(
+    r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}')
 DATA = {}
+INDEXES = {}
+INDEXED_VALUES = {}
+SORTED_IDS = {}
+SORTED_INDEXES = {}
+LOCKS = {}
+JSON_CACHE = {}
+TIMINGS = {}
+VERSIONS = {}
+VERSION_TAGS = {}
+_pending_loads = set()
+_next_polls = {}
+LAZY_LOAD = getenv("MODELS_LAZY_LOAD") is not None
+REINDEX_BATCH_SIZE = 2000
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, with the much faster
+    datetime.fromisoformat when the string has the exact layout (it
+    would also take offsets and other ISO 8601 forms strptime rejects).
+    Datetimes are immutable, so objects stored in the same second share
+    one instance
+    """
+    if _TIMESTAMP_LAYOUT.fullmatch(value):
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+class _Max():
+    """ Greater than anything: (value, _MAX) sorts after every
+    (value, id) entry of a sorted index
+    """
+
+    def __lt__(self, other) -> bool:
+        return False
+
+    def __gt__(self, other) -> bool:
+        return True
+
+
+_MAX = _Max()
 
 
 class Base():
     """ Base class
+
+    Stored attributes are declared in __slots__ so instances carry no
+    per-object __dict__; subclasses that don't declare __slots__ get one
+    back and keep accepting arbitrary attributes.
+
+    Subclasses list in indexed_attributes the attributes searched by
+    equality, and in sorted_attributes the ones searched by range or
+    prefix with search_range
     """
 
+    __slots__ = ("id", "created_at", "updated_at")
+    indexed_attributes = ()
+    sorted_attributes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        DATA.setdefault(s_class, {})
+        SORTED_IDS.setdefault(s_class, [])
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,7 +111,7 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +120,470 @@ class Base():
                 result[key] = value
         return result
 
+    def _attributes(self) -> Iterable[tuple]:
+        """ (name, value) of every attribute set on the object, slots
+        first in declaration order, then any __dict__ entry
+        """
+        cls = self.__class__
+        names = cls.__dict__.get("_slot_names")
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                slots = klass.__dict__.get("__slots__", ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                names.extend(n for n in slots
+                             if n not in ("__dict__", "__weakref__"))
+            names = tuple(names)
+            cls._slot_names = names
+        for name in names:
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                continue
+        yield from getattr(self, "__dict__", {}).items()
+
     @classmethod
-    def load_from_file(cls):
+    def load_from_file(cls, lazy: bool = False):
         """ Load all objects from file
+
+        The objects are read back from the storage engine selected by
+        MODELS_STORAGE. With lazy, loading waits for the first access to
+        the class
+        """
+        s_class = cls.__name__
+        if lazy:
+            _pending_loads.add(s_class)
+            return
+        storage = get_storage()
+        with cls._lock().writing(), storage.locked(s_class, shared=True):
+            start = time.perf_counter()
+            _pending_loads.discard(s_class)
+            storage.mark_loaded(s_class)
+            DATA[s_class] = {}
+            for op, obj_id, obj_json in storage.load(s_class):
+                if op == "save":
+                    DATA[s_class][obj_id] = cls(**obj_json)
+                else:
+                    DATA[s_class].pop(obj_id, None)
+            cls._rebuild_indexes()
+            cls._changed()
+            cls._timings("load").record(time.perf_counter() - start)
+
+    @classmethod
+    def _ensure_loaded(cls):
+        """ Run a load deferred by load_from_file(lazy=True), and with
+        MODELS_SHARED, pick up the changes of other processes at most
+        every MODELS_POLL_MS
+        """
+        s_class = cls.__name__
+        if s_class in _pending_loads:
+            with cls._lock().writing():
+                if s_class in _pending_loads:
+                    cls.load_from_file()
+        elif SHARED:
+            now = time.monotonic()
+            if now < _next_polls.get(s_class, 0):
+                return
+            _next_polls[s_class] = now + POLL_MS / 1000
+            storage = get_storage()
+            if storage.changed(s_class):
+                with cls._lock().writing(), \
+                        storage.locked(s_class, shared=True):
+                    cls._catch_up(storage)
+
+    @classmethod
+    def _catch_up(cls, storage):
+        """ Apply what other processes changed since this one last read
+        or wrote the class; the caller holds both locks
+
+        Journal entries are applied as they are. Otherwise everything is
+        read again, but only the objects that differ are replaced
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        if not storage.changed(s_class):
             return
+        start = time.perf_counter()
+        ops = storage.changes(s_class)
+        storage.mark_loaded(s_class)
+        if ops is None:
+            objs = DATA[s_class]
+            stored = {}
+            for op, obj_id, obj_json in storage.load(s_class):
+                if op == "save":
+                    stored[obj_id] = obj_json
+                else:
+                    stored.pop(obj_id, None)
+            changes = {obj_id: None for obj_id in objs
+                       if obj_id not in stored}
+            for obj_id, obj_json in stored.items():
+                obj = objs.get(obj_id)
+                if obj is None or obj.to_json(True) != obj_json:
+                    changes[obj_id] = cls(**obj_json)
+        else:
+            changes = {}
+            for op, obj_id, obj_json in ops:
+                changes[obj_id] = cls(**obj_json) if op == "save" else None
+        cls._apply(changes)
+        cls._timings("load").record(time.perf_counter() - start)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _apply(cls, changes: dict) -> dict:
+        """ Put in memory a batch of changes, mapping the ID of each saved
+        object to the object and of each removed one to None, and return
+        the ones that changed something
+
+        Batches of REINDEX_BATCH_SIZE objects or more rebuild the indexes
+        instead of updating them object by object
+        """
+        s_class = cls.__name__
+        objs = DATA[s_class]
+        sorted_ids = SORTED_IDS[s_class]
+        reindex = len(changes) >= REINDEX_BATCH_SIZE
+        applied = {}
+        for obj_id, obj in changes.items():
+            if obj is None:
+                if objs.pop(obj_id, None) is None:
+                    continue
+                if not reindex:
+                    del sorted_ids[bisect_left(sorted_ids, obj_id)]
+                    cls._unindex(obj_id)
+            else:
+                if not reindex and obj_id not in objs:
+                    insort(sorted_ids, obj_id)
+                objs[obj_id] = obj
+                if not reindex:
+                    cls._index(obj)
+            if not reindex:
+                cls._changed(obj_id)
+            applied[obj_id] = obj
+        if reindex:
+            cls._rebuild_indexes()
+            cls._changed()
+        return applied
+
+    @classmethod
+    def _lock(cls) -> ReadWriteLock:
+        """ Lock guarding the objects of the class
+
+        Lookups hold it for reading. Changes hold it for writing, then
+        downgrade it to persist: readers get back in, while the next
+        writer waits, so the storage always sees a consistent set of
+        objects and writes happen in order
+        """
+        s_class = cls.__name__
+        lock = LOCKS.get(s_class)
+        if lock is None:
+            lock = LOCKS.setdefault(s_class, ReadWriteLock())
+        return lock
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
-
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        storage = get_storage()
+        lock = cls._lock()
+        with lock.writing(), storage.locked(s_class):
+            cls._catch_up(storage)
+            lock.downgrade()
+            start = time.perf_counter()
+            storage.dump(s_class, DATA[s_class])
+            storage.mark_written(s_class)
+            cls._timings("save_to_file").record(time.perf_counter() - start)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        cls = self.__class__
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        storage = get_storage()
+        lock = cls._lock()
+        with lock.writing(), storage.locked(s_class):
+            cls._catch_up(storage)
+            self.updated_at = datetime.utcnow()
+            if self.id not in DATA[s_class]:
+                insort(SORTED_IDS[s_class], self.id)
+            DATA[s_class][self.id] = self
+            cls._index(self)
+            cls._changed(self.id)
+            lock.downgrade()
+            start = time.perf_counter()
+            storage.save(s_class, self, DATA[s_class])
+            storage.mark_written(s_class)
+            cls._timings("write").record(time.perf_counter() - start)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        cls = self.__class__
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        storage = get_storage()
+        lock = cls._lock()
+        with lock.writing(), storage.locked(s_class):
+            cls._catch_up(storage)
+            if DATA[s_class].pop(self.id, None) is None:
+                return
+            ids = SORTED_IDS[s_class]
+            del ids[bisect_left(ids, self.id)]
+            cls._unindex(self.id)
+            cls._changed(self.id)
+            lock.downgrade()
+            start = time.perf_counter()
+            storage.remove(s_class, self.id, DATA[s_class])
+            storage.mark_written(s_class)
+            cls._timings("write").record(time.perf_counter() - start)
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects of the class at once, with a single write to
+        the storage
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        storage = get_storage()
+        lock = cls._lock()
+        with lock.writing(), storage.locked(s_class):
+            cls._catch_up(storage)
+            now = datetime.utcnow()
+            changes = {}
+            for obj in objs:
+                obj.updated_at = now
+                changes[obj.id] = obj
+            if not changes:
+                return
+            cls._apply(changes)
+            lock.downgrade()
+            start = time.perf_counter()
+            storage.apply(s_class, changes, DATA[s_class])
+            storage.mark_written(s_class)
+            cls._timings("write").record(time.perf_counter() - start)
+
+    @classmethod
+    def remove_many(cls, ids: Iterable[str]) -> List[str]:
+        """ Remove the objects with these IDs at once, with a single
+        write to the storage, and return the IDs that existed
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        storage = get_storage()
+        lock = cls._lock()
+        with lock.writing(), storage.locked(s_class):
+            cls._catch_up(storage)
+            changes = cls._apply({obj_id: None for obj_id in ids})
+            if not changes:
+                return []
+            lock.downgrade()
+            start = time.perf_counter()
+            storage.apply(s_class, changes, DATA[s_class])
+            storage.mark_written(s_class)
+            cls._timings("write").record(time.perf_counter() - start)
+        return list(changes)
+
+    @classmethod
+    def _timings(cls, kind: str) -> Timings:
+        """ Timings of the class for kind: "load", "save_to_file" or
+        "write" (save, remove and their batch versions)
+        """
+        timings = TIMINGS.get(cls.__name__)
+        if timings is None:
+            timings = TIMINGS.setdefault(cls.__name__, {
+                "load": Timings(), "save_to_file": Timings(),
+                "write": Timings()})
+        return timings[kind]
+
+    @classmethod
+    def storage_stats(cls) -> dict:
+        """ Figures about the objects of the class and their storage,
+        all kept up to date as they change: nothing is scanned
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        storage = get_storage()
+        file_bytes = 0
+        for p in storage.paths(s_class):
+            try:
+                file_bytes += os.stat(p).st_size
+            except FileNotFoundError:
+                continue
+        version = cls.version()
+        with cls._lock().reading():
+            indexes = {"id": len(SORTED_IDS.get(s_class, ()))}
+            for attr, index in INDEXES.get(s_class, {}).items():
+                indexes[attr] = len(index)
+            for attr, index in SORTED_INDEXES.get(s_class, {}).items():
+                indexes["sorted_" + attr] = len(index)
+            return {
+                "objects": len(DATA.get(s_class, ())),
+                "version": version,
+                "file_bytes": file_bytes,
+                "indexes": indexes,
+                "load": cls._timings("load").snapshot(),
+                "save_to_file": cls._timings("save_to_file").snapshot(),
+                "write": cls._timings("write").snapshot(),
+            }
+
+    @classmethod
+    def _changed(cls, obj_id: str = None):
+        """ Move to a new version of the class, dropping the cached JSON
+        of obj_id, or of every object
+        """
+        s_class = cls.__name__
+        VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        if obj_id is None:
+            JSON_CACHE[s_class] = {}
+        else:
+            JSON_CACHE.get(s_class, {}).pop(obj_id, None)
+
+    @classmethod
+    def version(cls) -> str:
+        """ Strong ETag of the current state of the class objects: a
+        digest of the ETags of every object in ID order, so that every
+        process holding the same objects agrees on it. It is computed
+        again after each save, remove or load
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        with cls._lock().reading():
+            count = VERSIONS.get(s_class, 0)
+            cached = VERSION_TAGS.get(s_class)
+            if cached is not None and cached[0] == count:
+                return cached[1]
+            objs = DATA.get(s_class, {})
+            cache = JSON_CACHE.get(s_class, {})
+            etags = []
+            for obj_id in SORTED_IDS.get(s_class, []):
+                entry = cache.get(obj_id)
+                if entry is None:
+                    entry = objs[obj_id].cached_json()
+                etags.append(entry[1])
+            tag = hashlib.sha1("".join(etags).encode()).hexdigest()
+            VERSION_TAGS[s_class] = (count, tag)
+            return tag
+
+    def cached_json(self) -> Tuple[str, str]:
+        """ Return to_json() serialized as jsonify does, and a strong
+        ETag of it
+
+        Both are kept until the object is saved or removed, so changes
+        to an object only show up once it is saved
+        """
+        cls = self.__class__
+        s_class = cls.__name__
+        with cls._lock().reading():
+            cache = JSON_CACHE.get(s_class)
+            if cache is None:
+                cache = JSON_CACHE.setdefault(s_class, {})
+            entry = cache.get(self.id)
+            if entry is None:
+                data = json.dumps(self.to_json(), sort_keys=True,
+                                  separators=(",", ":"))
+                etag = hashlib.sha1(data.encode()).hexdigest()
+                entry = cache[self.id] = (data, etag)
+            return entry
+
+    @classmethod
+    def _rebuild_indexes(cls):
+        """ Index every loaded object on cls.indexed_attributes and
+        cls.sorted_attributes, and sort their ids
+        """
+        s_class = cls.__name__
+        SORTED_IDS[s_class] = sorted(DATA[s_class])
+        INDEXES[s_class] = {attr: {} for attr in cls.indexed_attributes}
+        SORTED_INDEXES[s_class] = {attr: []
+                                   for attr in cls.sorted_attributes}
+        INDEXED_VALUES[s_class] = {}
+        for obj in DATA[s_class].values():
+            cls._index(obj, bulk=True)
+        for attr, index in SORTED_INDEXES[s_class].items():
+            try:
+                index.sort()
+            except TypeError:
+                # values that can't be compared: insert them one by one,
+                # leaving out the ones that don't fit
+                entries, index[:] = list(index), []
+                for entry in entries:
+                    try:
+                        insort(index, entry)
+                    except TypeError:
+                        continue
+
+    @classmethod
+    def _index(cls, obj: TypeVar('Base'), bulk: bool = False):
+        """ Point the indexes at the current attribute values of obj
+
+        With bulk, sorted index entries are only appended, and
+        _rebuild_indexes sorts them at the end
+        """
+        if not cls.indexed_attributes and not cls.sorted_attributes:
+            return
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            cls._rebuild_indexes()
+        cls._unindex(obj.id)
+        indexes = INDEXES[s_class]
+        values = {}
+        for attr in cls.indexed_attributes:
+            value = getattr(obj, attr, None)
+            try:
+                indexes[attr].setdefault(value, {})[obj.id] = None
+            except TypeError:
+                continue  # unhashable value, search falls back to a scan
+            values[attr] = value
+        for attr, index in SORTED_INDEXES[s_class].items():
+            value = getattr(obj, attr, None)
+            if value is None:
+                continue
+            if bulk:
+                index.append((value, obj.id))
+            else:
+                try:
+                    insort(index, (value, obj.id))
+                except TypeError:
+                    continue  # can't be ordered with the other values
+            values[attr] = value
+        INDEXED_VALUES[s_class][obj.id] = values
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """ Drop obj_id from the indexes
+        """
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            return
+        indexes = INDEXES[s_class]
+        values = INDEXED_VALUES[s_class].pop(obj_id, None)
+        if values is None:
+            return
+        sorted_indexes = SORTED_INDEXES[s_class]
+        for attr, value in values.items():
+            if attr in indexes:
+                ids = indexes[attr].get(value)
+                if ids is not None:
+                    ids.pop(obj_id, None)
+                    if not ids:
+                        del indexes[attr][value]
+            index = sorted_indexes.get(attr)
+            if index is not None and value is not None:
+                entry = (value, obj_id)
+                try:
+                    i = bisect_left(index, entry)
+                except TypeError:
+                    continue  # was never in the sorted index
+                if i < len(index) and index[i] == entry:
+                    del index[i]
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        with cls._lock().reading():
+            return len(DATA[s_class].keys())
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,13 +595,19 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        with cls._lock().reading():
+            return DATA[s_class].get(id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        When an attribute is indexed, only the objects the index points at
+        are checked instead of all of them
         """
+        cls._ensure_loaded()
         s_class = cls.__name__
         def _search(obj):
             if len(attributes) == 0:
@@ -133,5 +616,84 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        with cls._lock().reading():
+            candidates = DATA[s_class].values()
+            indexes = INDEXES.get(s_class)
+            if indexes is not None:
+                for k, v in attributes.items():
+                    if k in cls.indexed_attributes:
+                        try:
+                            ids = indexes[k].get(v, {})
+                        except TypeError:
+                            continue  # unhashable value, can't be indexed
+                    elif k in cls.sorted_attributes and v is not None:
+                        index = SORTED_INDEXES[s_class][k]
+                        try:
+                            start = bisect_left(index, (v,))
+                            end = bisect_left(index, (v, _MAX), start)
+                        except TypeError:
+                            continue  # can't be compared with the index
+                        ids = [i for _, i in index[start:end]]
+                    else:
+                        continue
+                    objs = DATA[s_class]
+                    candidates = [objs[i] for i in ids if i in objs]
+                    break
+            return list(filter(_search, candidates))
+
+    @classmethod
+    def page(cls, limit: int = None,
+             after: str = None) -> List[TypeVar('Base')]:
+        """ Return up to limit objects ordered by ID, starting after the
+        ID after
+
+        The ID of the last object is the cursor of the next page; it
+        stays valid even if that object is removed meanwhile
+        """
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        with cls._lock().reading():
+            ids = SORTED_IDS[s_class]
+            start = 0 if after is None else bisect_right(ids, after)
+            end = len(ids) if limit is None else start + limit
+            objs = DATA[s_class]
+            return [objs[i] for i in ids[start:end]]
+
+    @classmethod
+    def search_range(cls, attribute: str, after=None, before=None,
+                     prefix: str = None, limit: int = None,
+                     cursor: Tuple = None) -> List[TypeVar('Base')]:
+        """ Return the objects whose attribute is greater than after, less
+        than before and starts with prefix, ordered by that attribute
+        then by ID, in O(log N + limit)
+
+        attribute must be in cls.sorted_attributes; objects where it's
+        None aren't indexed. cursor is the (attribute value, ID) of the
+        last object of the previous page; like the cursor of page, it
+        stays valid even if that object is removed or changed meanwhile
+        """
+        if attribute not in cls.sorted_attributes:
+            raise ValueError("{} isn't a sorted attribute".format(attribute))
+        cls._ensure_loaded()
+        s_class = cls.__name__
+        with cls._lock().reading():
+            if s_class not in SORTED_INDEXES:
+                return []
+            index = SORTED_INDEXES[s_class][attribute]
+            start, end = 0, len(index)
+            if cursor is not None:
+                start = bisect_right(index, tuple(cursor))
+            if after is not None:
+                start = max(start, bisect_left(index, (after, _MAX)))
+            if before is not None:
+                end = min(end, bisect_left(index, (before,)))
+            if prefix:
+                start = max(start, bisect_left(index, (prefix,)))
+                if ord(prefix[-1]) < sys.maxunicode:
+                    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                    end = min(end, bisect_left(index, (upper,)))
+            if limit is not None:
+                end = min(end, start + limit)
+            objs = DATA[s_class]
+            return [objs[i] for _, i in index[start:end]]
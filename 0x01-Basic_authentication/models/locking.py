@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+""" Locking module
+"""
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock():
+    """ Lock shared by any number of readers, or held by a single writer
+
+    Writers get the lock in arrival order, and waiting writers keep new
+    readers out so they can't be starved, but a thread already holding
+    the lock may always take it again, for reading or, when it is the
+    writer, for writing. A writer can downgrade to a read lock to let
+    readers in while it persists what it just wrote
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._next_ticket = 0
+        self._serving = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        """ Hold the lock for reading during the with block
+        """
+        if self._writer == threading.get_ident():
+            yield
+            return
+        held = getattr(self._local, "reads", 0)
+        with self._cond:
+            if not held:
+                while (self._writer is not None
+                       or self._next_ticket != self._serving):
+                    self._cond.wait()
+            self._readers += 1
+        self._local.reads = held + 1
+        try:
+            yield
+        finally:
+            self._release_read()
+
+    @contextmanager
+    def writing(self):
+        """ Hold the lock for writing during the with block
+        """
+        me = threading.get_ident()
+        if self._writer == me:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        if getattr(self._local, "reads", 0):
+            raise RuntimeError("A read lock can't be upgraded")
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while (ticket != self._serving or self._writer is not None
+                   or self._readers):
+                self._cond.wait()
+            self._serving += 1
+            self._writer = me
+            self._depth = 1
+        try:
+            yield
+        finally:
+            if self._writer == me:
+                with self._cond:
+                    self._writer = None
+                    self._depth = 0
+                    self._cond.notify_all()
+            else:
+                self._release_read()
+
+    def downgrade(self):
+        """ Turn the write lock of the current thread into a read lock until
+        the end of its writing() block. Does nothing in a nested writing()
+        block, as the outer one still expects to write
+        """
+        if self._writer != threading.get_ident():
+            raise RuntimeError("The write lock isn't held by this thread")
+        if self._depth > 1:
+            return
+        with self._cond:
+            self._writer = None
+            self._depth = 0
+            self._readers += 1
+            self._cond.notify_all()
+        self._local.reads = getattr(self._local, "reads", 0) + 1
+
+    def _release_read(self):
+        """ Give back one read hold of the current thread
+        """
+        self._local.reads -= 1
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+""" Statistics module
+"""
+from collections import deque
+import threading
+
+
+class Timings():
+    """ Durations of one operation: how many, the last one, the average,
+    and the 99th percentile of the window most recent ones
+    """
+
+    def __init__(self, window: int = 1000):
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.last = None
+
+    def record(self, seconds: float):
+        """ Add one duration
+        """
+        with self._lock:
+            self._recent.append(seconds)
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+
+    def snapshot(self) -> dict:
+        """ Current figures, in milliseconds
+        """
+        with self._lock:
+            recent = sorted(self._recent)
+            count, total, last = self.count, self.total, self.last
+        if not count:
+            return {"count": 0, "last_ms": None, "avg_ms": None,
+                    "p99_ms": None}
+        return {
+            "count": count,
+            "last_ms": round(last * 1000, 3),
+            "avg_ms": round(total / count * 1000, 3),
+            "p99_ms": round(recent[int(len(recent) * 0.99)] * 1000, 3),
+        }
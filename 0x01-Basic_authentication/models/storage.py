@@ -0,0 +1,798 @@
+#!/usr/bin/env python3
+""" Storage engines module
+
+A storage engine persists the objects of each model class. The engine is
+picked with the MODELS_STORAGE environment variable:
+  - json: .db_<Class>.json file rewritten on every change (default)
+  - journal: json snapshot plus an append-only .db_<Class>.journal
+  - sqlite: one row per object in an embedded SQLite database
+  - marshal: compact binary .db_<Class>.marshal snapshot
+
+MODELS_WRITE_BEHIND_MS > 0 wraps the engine in a WriteBehindStorage
+that batches writes, and MODELS_FSYNC=always makes every write durable
+before it returns.
+
+MODELS_SHARED lets several processes use the same files: writes hold an
+exclusive lock on .db_<Class>.lock and first catch up with the other
+processes, and reads check every MODELS_POLL_MS whether the files
+changed. Writes are never deferred then
+"""
+from contextlib import contextmanager
+from os import getenv, path
+from typing import Iterator, List, Optional, Tuple
+import atexit
+import fcntl
+import json
+import logging
+import marshal
+import os
+import re
+import sqlite3
+import struct
+import threading
+
+
+JOURNAL_MAX_BYTES = int(getenv("MODELS_JOURNAL_MAX_BYTES", 4 * 1024 * 1024))
+SQLITE_PATH = getenv("MODELS_SQLITE_PATH", ".db.sqlite3")
+LOAD_CHUNK_SIZE = 64 * 1024
+MARSHAL_BLOCK_SIZE = 1000
+FSYNC = getenv("MODELS_FSYNC", "never")
+WRITE_BEHIND_MS = int(getenv("MODELS_WRITE_BEHIND_MS", "0"))
+WRITE_BEHIND_MAX_PENDING = int(getenv("MODELS_WRITE_BEHIND_MAX_PENDING",
+                                      "1000"))
+SHARED = getenv("MODELS_SHARED") is not None
+POLL_MS = int(getenv("MODELS_POLL_MS", "1000"))
+_logger = logging.getLogger(__name__)
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def iter_json_items(f, chunk_size: int = LOAD_CHUNK_SIZE):
+    """ Yield the (key, value) pairs of the top-level JSON object of a
+    file, reading it chunk by chunk instead of parsing it all at once
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = chunk == ""
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # a number cut by the end of the chunk decodes too, as
+                # its integer part: only trust what is followed by more
+                if eof or (end < len(buf) and buf[end] not in _NUMBER_CHARS):
+                    pos = end
+                    return value
+            except ValueError:
+                if eof:
+                    raise
+            fill()
+
+    def expect(char):
+        nonlocal pos
+        skip()
+        if buf[pos:pos + 1] != char:
+            raise ValueError("Expecting '{}' at offset {}".format(char, pos))
+        pos += 1
+
+    expect('{')
+    skip()
+    if buf[pos:pos + 1] == '}':
+        return
+    while True:
+        skip()
+        key = decode()
+        expect(':')
+        skip()
+        yield key, decode()
+        skip()
+        if buf[pos:pos + 1] == '}':
+            return
+        expect(',')
+
+
+def sync(f):
+    """ Flush f to disk when the fsync policy asks for it
+    """
+    f.flush()
+    if FSYNC == "always":
+        os.fsync(f.fileno())
+
+
+class Storage():
+    """ Storage engine interface
+
+    load yields ("save", id, serialized object) and ("remove", id, None)
+    operations to apply in order. objs is always the dict of every object
+    of the class, by id.
+
+    With SHARED, the engine tracks what this process last read or wrote
+    of each class: a generation counter that writers bump in the lock
+    file, plus the inode, mtime and size of every file in paths()
+    """
+
+    def __init__(self):
+        self._seen = {}
+        self._counters = {}
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Read back the stored objects of a class
+        """
+        raise NotImplementedError
+
+    def dump(self, s_class: str, objs: dict):
+        """ Replace the stored objects of a class by objs
+        """
+        raise NotImplementedError
+
+    def save(self, s_class: str, obj, objs: dict):
+        """ Persist one created or updated object
+        """
+        self.dump(s_class, objs)
+
+    def remove(self, s_class: str, obj_id: str, objs: dict):
+        """ Persist the removal of one object
+        """
+        self.dump(s_class, objs)
+
+    def apply(self, s_class: str, changes: dict, objs: dict):
+        """ Persist a batch of changes at once: changes maps the id of
+        each saved object to the object, and of each removed one to None
+        """
+        self.dump(s_class, objs)
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ Files holding the objects of a class
+        """
+        return ()
+
+    def lock_path(self, s_class: str) -> str:
+        """ Path of the lock file of a class
+        """
+        return ".db_{}.lock".format(s_class)
+
+    @contextmanager
+    def locked(self, s_class: str, shared: bool = False):
+        """ Hold the lock file of a class, exclusively or shared, during
+        the with block. Does nothing without SHARED
+        """
+        if not SHARED:
+            yield
+            return
+        fd = os.open(self.lock_path(s_class), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _counter(self, s_class: str) -> int:
+        """ File descriptor of the lock file, holding the generation
+        """
+        fd = self._counters.get(s_class)
+        if fd is None:
+            fd = os.open(self.lock_path(s_class), os.O_RDWR | os.O_CREAT)
+            self._counters[s_class] = fd
+        return fd
+
+    def signature(self, s_class: str) -> tuple:
+        """ Generation and (inode, mtime, size) of every file of a class
+        """
+        data = os.pread(self._counter(s_class), 8, 0)
+        stats = []
+        for p in self.paths(s_class):
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                stats.append(None)
+                continue
+            stats.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        generation = struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+        return (generation,) + tuple(stats)
+
+    def changed(self, s_class: str) -> bool:
+        """ Whether another process changed the objects of a class since
+        this one last read or wrote them. Always False without SHARED
+        """
+        if not SHARED:
+            return False
+        return self.signature(s_class) != self._seen.get(s_class)
+
+    def changes(self, s_class: str) -> Optional[List[Tuple[str, str,
+                                                          dict]]]:
+        """ Operations made by other processes since this one last read
+        or wrote a class, in the format of load, or None when only
+        loading everything again can tell
+        """
+        return None
+
+    def mark_loaded(self, s_class: str):
+        """ Record that this process is up to date with a class
+        """
+        if SHARED:
+            self._seen[s_class] = self.signature(s_class)
+
+    def mark_written(self, s_class: str):
+        """ Bump the generation of a class after a write, holding its
+        exclusive lock, and record it as seen
+        """
+        if not SHARED:
+            return
+        fd = self._counter(s_class)
+        data = os.pread(fd, 8, 0)
+        generation = struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+        os.pwrite(fd, struct.pack("<Q", generation + 1), 0)
+        self._seen[s_class] = self.signature(s_class)
+
+
+class JsonStorage(Storage):
+    """ One JSON file per class, rewritten on every change
+    """
+
+    def file_path(self, s_class: str) -> str:
+        """ Path of the data file of a class
+        """
+        return ".db_{}.json".format(s_class)
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ The data file
+        """
+        return (self.file_path(s_class),)
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Stream the objects of the data file
+        """
+        file_path = self.file_path(s_class)
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            for obj_id, obj_json in iter_json_items(f):
+                yield "save", obj_id, obj_json
+
+    def dump(self, s_class: str, objs: dict):
+        """ Rewrite the data file, through a temporary file so readers
+        never see it half written
+        """
+        objs_json = {}
+        for obj_id, obj in objs.items():
+            objs_json[obj_id] = obj.to_json(True)
+
+        file_path = self.file_path(s_class)
+        with open(file_path + ".tmp", 'w') as f:
+            json.dump(objs_json, f)
+            sync(f)
+        os.replace(file_path + ".tmp", file_path)
+
+
+class JournalStorage(JsonStorage):
+    """ JSON snapshot plus a journal of the changes made since
+
+    Every change appends one line to the journal; once the journal is
+    bigger than JOURNAL_MAX_BYTES the snapshot is rewritten in the
+    background and the journal dropped
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._journals = {}
+        self._compacting = set()
+        self._lock = threading.Lock()
+        self._compacted = threading.Condition(self._lock)
+
+    def journal_path(self, s_class: str) -> str:
+        """ Path of the journal file of a class
+        """
+        return ".db_{}.journal".format(s_class)
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ The snapshot, the journal and the journal being compacted
+        """
+        journal_path = self.journal_path(s_class)
+        return (self.file_path(s_class), journal_path, journal_path + ".old")
+
+    def changes(self, s_class: str) -> Optional[List[Tuple[str, str,
+                                                          dict]]]:
+        """ The entries appended to the journal since it was last read
+        or written, as long as it's the same journal and the snapshot
+        didn't change
+        """
+        seen = self._seen.get(s_class)
+        now = self.signature(s_class)
+        if seen is None or seen[1] != now[1] or seen[3] != now[3] or \
+                seen[2] is None or now[2] is None or \
+                seen[2][0] != now[2][0] or seen[2][2] > now[2][2]:
+            return None
+        with open(self.journal_path(s_class), 'r') as f:
+            f.seek(seen[2][2])
+            return list(self._entries(f))
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Stream the snapshot, then every complete journal entry
+
+        The files are all opened at once, holding the lock, so that a
+        compaction ending meanwhile can't swap the snapshot or remove the
+        journal being compacted between the two reads
+        """
+        files = []
+        try:
+            with self._lock:
+                for p in self.paths(s_class):
+                    try:
+                        files.append(open(p, 'r'))
+                    except FileNotFoundError:
+                        files.append(None)
+            snapshot, journal, old_journal = files
+            if snapshot is not None:
+                for obj_id, obj_json in iter_json_items(snapshot):
+                    yield "save", obj_id, obj_json
+            for f in (old_journal, journal):
+                if f is not None:
+                    yield from self._entries(f)
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+
+    def _entries(self, f) -> Iterator[Tuple[str, str, dict]]:
+        """ Parse the journal lines from the position of f, skipping the
+        ones torn by a crash in the middle of a write
+        """
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["op"] == "save":
+                yield "save", entry["obj"]["id"], entry["obj"]
+            else:
+                yield "remove", entry["id"], None
+
+    def dump(self, s_class: str, objs: dict):
+        """ Rewrite the snapshot now
+        """
+        self.compact(s_class, objs, background=False)
+
+    def save(self, s_class: str, obj, objs: dict):
+        """ Journal the new state of obj
+        """
+        self._append(s_class, {"op": "save", "obj": obj.to_json(True)},
+                     objs)
+
+    def remove(self, s_class: str, obj_id: str, objs: dict):
+        """ Journal the removal of obj_id
+        """
+        self._append(s_class, {"op": "remove", "id": obj_id}, objs)
+
+    def apply(self, s_class: str, changes: dict, objs: dict):
+        """ Journal a batch of changes with a single write
+        """
+        entries = []
+        for obj_id, obj in changes.items():
+            if obj is None:
+                entries.append({"op": "remove", "id": obj_id})
+            else:
+                entries.append({"op": "save", "obj": obj.to_json(True)})
+        self._append(s_class, entries, objs)
+
+    def _append(self, s_class: str, entries, objs: dict):
+        """ Append changes to the journal, and start a compaction once
+        the journal is bigger than JOURNAL_MAX_BYTES
+        """
+        if isinstance(entries, dict):
+            entries = [entries]
+        data = ''.join(json.dumps(entry) + "\n" for entry in entries)
+        with self._lock:
+            f = self._journals.get(s_class)
+            if f is not None and SHARED and not self._current(f, s_class):
+                f.close()  # another process compacted the journal
+                f = None
+            if f is None:
+                f = open(self.journal_path(s_class), 'a+')
+                self._journals[s_class] = f
+            if self._torn(f):
+                # a crashed write left half a line: end it rather than
+                # truncate, as other processes keep offsets in the file
+                data = "\n" + data
+            f.write(data)
+            sync(f)
+            size = f.tell()
+        if size > JOURNAL_MAX_BYTES:
+            # other processes may write as soon as the lock is released,
+            # so the compaction has to be over by then
+            self.compact(s_class, objs, background=not SHARED)
+
+    def _torn(self, f) -> bool:
+        """ Whether the journal open in f doesn't end with a whole line
+        """
+        size = os.fstat(f.fileno()).st_size
+        return size > 0 and os.pread(f.fileno(), 1, size - 1) != b"\n"
+
+    def _current(self, f, s_class: str) -> bool:
+        """ Whether f is still the journal file of a class
+        """
+        try:
+            return os.fstat(f.fileno()).st_ino == \
+                os.stat(self.journal_path(s_class)).st_ino
+        except FileNotFoundError:
+            return False
+
+    def compact(self, s_class: str, objs: dict, background: bool = True):
+        """ Rewrite the snapshot and drop the journal
+
+        The journal is rotated aside first, so changes made while the
+        snapshot is written land in a new journal. A background compaction
+        already running is enough, but a synchronous one waits for it to
+        end and then writes its own snapshot
+        """
+        file_path = self.file_path(s_class)
+        journal_path = self.journal_path(s_class)
+        with self._lock:
+            if s_class in self._compacting:
+                if background:
+                    return
+                while s_class in self._compacting:
+                    self._compacted.wait()
+            self._compacting.add(s_class)
+            f = self._journals.pop(s_class, None)
+            if f is not None:
+                f.close()
+            if path.exists(journal_path):
+                os.replace(journal_path, journal_path + ".old")
+            snapshot = list(objs.values())
+
+        def write_snapshot():
+            try:
+                objs_json = {obj.id: obj.to_json(True) for obj in snapshot}
+                with open(file_path + ".tmp", 'w') as f:
+                    json.dump(objs_json, f)
+                    sync(f)
+                with self._lock:
+                    os.replace(file_path + ".tmp", file_path)
+                    if path.exists(journal_path + ".old"):
+                        os.remove(journal_path + ".old")
+            finally:
+                with self._lock:
+                    self._compacting.discard(s_class)
+                    self._compacted.notify_all()
+
+        if background:
+            threading.Thread(target=write_snapshot, daemon=True).start()
+        else:
+            write_snapshot()
+
+
+class SQLiteStorage(Storage):
+    """ One table per class in an embedded SQLite database, holding each
+    object as a JSON document; saves and removes touch a single row
+    """
+
+    def __init__(self, db_path: str = None):
+        super().__init__()
+        self.db_path = db_path or SQLITE_PATH
+        self._connection = None
+        self._tables = set()
+        self._lock = threading.Lock()
+
+    def _table(self, s_class: str) -> str:
+        """ Open the database and create the table of a class if needed,
+        return its quoted name
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous={}".format(
+                "FULL" if FSYNC == "always" else "NORMAL"))
+        table = '"{}"'.format(s_class.replace('"', '""'))
+        if s_class not in self._tables:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL)".format(table))
+            self._tables.add(s_class)
+        return table
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ The database and its write-ahead log
+        """
+        return (self.db_path, self.db_path + "-wal")
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Stream every row, in insertion order
+        """
+        with self._lock:
+            table = self._table(s_class)
+            cursor = self._connection.execute(
+                "SELECT id, data FROM {} ORDER BY rowid".format(table))
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for obj_id, data in rows:
+                yield "save", obj_id, json.loads(data)
+
+    def dump(self, s_class: str, objs: dict):
+        """ Replace every row in one transaction
+        """
+        with self._lock:
+            table = self._table(s_class)
+            with self._connection:
+                self._connection.execute("DELETE FROM {}".format(table))
+                self._connection.executemany(
+                    "INSERT INTO {} (id, data) VALUES (?, ?)".format(table),
+                    ((obj_id, json.dumps(obj.to_json(True)))
+                     for obj_id, obj in objs.items()))
+
+    def save(self, s_class: str, obj, objs: dict):
+        """ Upsert the row of obj
+        """
+        data = json.dumps(obj.to_json(True))
+        with self._lock:
+            table = self._table(s_class)
+            with self._connection:
+                self._connection.execute(
+                    "INSERT INTO {} (id, data) VALUES (?, ?) ON CONFLICT(id)"
+                    " DO UPDATE SET data = excluded.data".format(table),
+                    (obj.id, data))
+
+    def remove(self, s_class: str, obj_id: str, objs: dict):
+        """ Delete the row of obj_id
+        """
+        with self._lock:
+            table = self._table(s_class)
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM {} WHERE id = ?".format(table), (obj_id,))
+
+    def apply(self, s_class: str, changes: dict, objs: dict):
+        """ Upsert and delete a batch of rows in one transaction
+        """
+        saved = [(obj_id, json.dumps(obj.to_json(True)))
+                 for obj_id, obj in changes.items() if obj is not None]
+        removed = [(obj_id,) for obj_id, obj in changes.items()
+                   if obj is None]
+        with self._lock:
+            table = self._table(s_class)
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO {} (id, data) VALUES (?, ?) ON CONFLICT(id)"
+                    " DO UPDATE SET data = excluded.data".format(table),
+                    saved)
+                self._connection.executemany(
+                    "DELETE FROM {} WHERE id = ?".format(table), removed)
+
+
+class MarshalStorage(Storage):
+    """ Binary snapshot per class: a sequence of marshal blocks of up to
+    MARSHAL_BLOCK_SIZE objects, much faster to write and read back than
+    JSON
+    """
+
+    def file_path(self, s_class: str) -> str:
+        """ Path of the data file of a class
+        """
+        return ".db_{}.marshal".format(s_class)
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ The data file
+        """
+        return (self.file_path(s_class),)
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Stream the data file block by block
+        """
+        file_path = self.file_path(s_class)
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'rb') as f:
+            while True:
+                try:
+                    block = marshal.load(f)
+                except EOFError:
+                    return
+                for obj_json in block:
+                    yield "save", obj_json["id"], obj_json
+
+    def dump(self, s_class: str, objs: dict):
+        """ Rewrite the data file
+        """
+        file_path = self.file_path(s_class)
+        with open(file_path + ".tmp", 'wb') as f:
+            block = []
+            for obj in objs.values():
+                block.append(obj.to_json(True))
+                if len(block) == MARSHAL_BLOCK_SIZE:
+                    marshal.dump(block, f)
+                    block = []
+            if block:
+                marshal.dump(block, f)
+            sync(f)
+        os.replace(file_path + ".tmp", file_path)
+
+
+class WriteBehindStorage(Storage):
+    """ Wraps an engine so saves and removes only mark their class dirty
+
+    A background thread hands the pending changes to the engine in one
+    batch every interval_ms, or as soon as max_pending changes are
+    waiting. flush() persists everything synchronously and runs at exit.
+    A batch the engine fails to write goes back to the pending changes,
+    behind any newer change of the same objects, to be written again
+    """
+
+    def __init__(self, engine: Storage, interval_ms: int = WRITE_BEHIND_MS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        super().__init__()
+        self.engine = engine
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self._pending = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, str, dict]]:
+        """ Flush, then read back through the engine
+        """
+        self.flush()
+        return self.engine.load(s_class)
+
+    def dump(self, s_class: str, objs: dict):
+        """ Rewrite everything now; pending changes of the class are
+        part of objs already
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending = self._pending.pop(s_class, None)
+                if pending is not None:
+                    self._count -= len(pending[0])
+            try:
+                self.engine.dump(s_class, objs)
+            except Exception:
+                if pending is not None:
+                    self._requeue({s_class: pending})
+                raise
+
+    def save(self, s_class: str, obj, objs: dict):
+        """ Queue the save of obj
+        """
+        self._mark(s_class, obj.id, obj, objs)
+
+    def remove(self, s_class: str, obj_id: str, objs: dict):
+        """ Queue the removal of obj_id
+        """
+        self._mark(s_class, obj_id, None, objs)
+
+    def apply(self, s_class: str, changes: dict, objs: dict):
+        """ Queue a batch of changes
+        """
+        for obj_id, obj in changes.items():
+            self._mark(s_class, obj_id, obj, objs)
+
+    def _mark(self, s_class: str, obj_id: str, obj, objs: dict):
+        """ Record one change, later changes of an object replacing
+        earlier ones
+        """
+        with self._cond:
+            changes, _ = self._pending.setdefault(s_class, ({}, objs))
+            if obj_id not in changes:
+                self._count += 1
+            changes[obj_id] = obj
+            if self._count >= self.max_pending:
+                self._cond.notify()
+
+    def paths(self, s_class: str) -> Tuple[str, ...]:
+        """ The files of the engine
+        """
+        return self.engine.paths(s_class)
+
+    def flush(self):
+        """ Persist every pending change before returning
+        """
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._count = 0
+            while pending:
+                s_class = next(iter(pending))
+                changes, objs = pending[s_class]
+                try:
+                    # copied in one step, as other threads keep saving
+                    self.engine.apply(s_class, changes, dict(objs))
+                except Exception:
+                    self._requeue(pending)
+                    raise
+                del pending[s_class]
+
+    def _requeue(self, pending: dict):
+        """ Put back changes that couldn't be written, unless the same
+        objects changed again since
+        """
+        with self._cond:
+            for s_class, (changes, objs) in pending.items():
+                queued, _ = self._pending.setdefault(s_class, ({}, objs))
+                for obj_id, obj in changes.items():
+                    if obj_id not in queued:
+                        queued[obj_id] = obj
+                        self._count += 1
+
+    def close(self):
+        """ Flush and stop the background thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        """ Background flusher; after a failed batch it waits a whole
+        interval before trying again
+        """
+        failed = False
+        while True:
+            with self._cond:
+                if (failed or self._count < self.max_pending) and \
+                        not self._closed:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+                failed = False
+            except Exception:
+                _logger.exception("Write-behind flush failed, the changes "
+                                  "are kept to be written again")
+                failed = True
+
+
+ENGINES = {
+    "json": JsonStorage,
+    "journal": JournalStorage,
+    "sqlite": SQLiteStorage,
+    "marshal": MarshalStorage,
+}
+_storage = None
+
+
+def use_storage(name: str, write_behind_ms: int = 0) -> Storage:
+    """ Switch every model to the engine called name, batching writes
+    every write_behind_ms when it is positive, unless SHARED
+    """
+    global _storage
+    if name not in ENGINES:
+        raise ValueError("Unknown storage engine: {}".format(name))
+    if isinstance(_storage, WriteBehindStorage):
+        _storage.close()
+    _storage = ENGINES[name]()
+    if write_behind_ms > 0 and not SHARED:
+        _storage = WriteBehindStorage(_storage, write_behind_ms)
+    return _storage
+
+
+def get_storage() -> Storage:
+    """ Return the engine selected by MODELS_STORAGE
+    """
+    if _storage is None:
+        return use_storage(getenv("MODELS_STORAGE", "json"),
+                           WRITE_BEHIND_MS)
+    return _storage
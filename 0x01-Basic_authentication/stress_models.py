@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+""" Stress test of concurrent access to the models
+
+Usage:
+  ./stress_models.py [threads] [operations_per_thread] [engine ...]
+
+Every thread creates, updates, deletes and searches users at random while
+another keeps saving the whole class to file. At the end the in-memory
+objects, the indexes and what the storage engine reads back must agree
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from models import base, storage
+from models.user import User
+
+
+def worker(seed: int, operations: int, errors: list):
+    """ Runs random operations on users, recording any exception
+    """
+    rnd = random.Random(seed)
+    mine = []
+    try:
+        for i in range(operations):
+            op = rnd.random()
+            if op < 0.4 or not mine:
+                user = User(email="w{}-{}@example.com".format(seed, i),
+                            first_name="First")
+                user.save()
+                mine.append(user)
+            elif op < 0.6:
+                user = rnd.choice(mine)
+                user.first_name = "Updated{}".format(i)
+                user.save()
+            elif op < 0.75:
+                user = mine.pop(rnd.randrange(len(mine)))
+                user.remove()
+            elif op < 0.9:
+                user = rnd.choice(mine)
+                found = User.search({"email": user.email})
+                if found != [user]:
+                    raise AssertionError("search by email found {}"
+                                         .format(found))
+            else:
+                User.count()
+                User.search({"first_name": "First"})
+    except Exception as e:
+        errors.append(e)
+
+
+def saver(stop: threading.Event, errors: list):
+    """ Keeps rewriting the whole class while the workers run
+    """
+    try:
+        while not stop.is_set():
+            User.save_to_file()
+    except Exception as e:
+        errors.append(e)
+
+
+def check(name: str):
+    """ Compares the objects in memory with their indexes and with what
+    the storage reads back
+    """
+    objs = base.DATA["User"]
+    emails = {u.id: u.email for u in objs.values()}
+    indexed = {i: v["email"]
+               for i, v in base.INDEXED_VALUES["User"].items()}
+    if indexed != emails:
+        raise AssertionError("{}: index out of sync".format(name))
+    state = {u.id: u.to_json(True) for u in objs.values()}
+    User.load_from_file()
+    loaded = {u.id: u.to_json(True) for u in base.DATA["User"].values()}
+    if loaded != state:
+        raise AssertionError("{}: storage holds {} users, memory {}"
+                             .format(name, len(loaded), len(state)))
+
+
+def stress(name: str, threads: int, operations: int):
+    """ Runs the workers against one storage engine in a scratch
+    directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            storage.use_storage(name)
+            User.load_from_file()
+            errors = []
+            stop = threading.Event()
+            background = threading.Thread(target=saver, args=(stop, errors))
+            workers = [threading.Thread(target=worker,
+                                        args=(seed, operations, errors))
+                       for seed in range(threads)]
+            start = time.perf_counter()
+            background.start()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            stop.set()
+            background.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            check(name)
+        finally:
+            os.chdir(cwd)
+    print("{:<8} {} threads x {} operations in {:.2f}s, {} users left"
+          .format(name, threads, operations, elapsed, User.count()))
+
+
+def main():
+    """ Stresses every storage engine named on the command line
+    """
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for name in sys.argv[3:] or list(storage.ENGINES):
+        stress(name, threads, operations)
+
+
+if __name__ == "__main__":
+    main()